@@ -1,4 +1,4 @@
 """
 Pytest configuration file to ensure plugins are loaded.
 """
-from pytest_jira_plugin import * 
\ No newline at end of file
+from pytest_jira_plugin_screenshots import * 
\ No newline at end of file
@@ -2,9 +2,24 @@ import pytest
 import requests
 import json
 import os
+import re
 import base64
+import shutil
+import zipfile
+import mimetypes
+import time
+import uuid
+import threading
+import contextlib
+from urllib.parse import urlparse
 from pathlib import Path
 from datetime import datetime, UTC
+from playwright.sync_api import sync_playwright
+
+try:
+    import psutil  # Optional, only needed for --xray-resource-monitor
+except ImportError:
+    psutil = None
 
 # Xray Cloud API configuration
 # Default values are provided for development, but should be overridden in CI/CD
@@ -21,6 +36,35 @@ os.makedirs("logs", exist_ok=True)
 SCREENSHOTS_DIR = "screenshots"
 os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
 
+# Playwright trace/video directory - only artifacts of failed tests are kept here
+ARTIFACTS_DIR = "artifacts"
+os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+
+# Evidence recording modes for traces and videos
+EVIDENCE_MODES = ("off", "on", "retain-on-failure")
+
+# Evidences are embedded as base64 in the Xray import request, so keep them bounded
+DEFAULT_EVIDENCE_MAX_BYTES = 10 * 1024 * 1024
+
+# Playwright browser engines and the Xray test environment each one is reported as
+BROWSER_ENVIRONMENTS = {
+    "chromium": "Chrome",
+    "firefox": "Firefox",
+    "webkit": "WebKit"
+}
+
+# Test environment of results not produced by the browser fixtures
+DEFAULT_TEST_ENVIRONMENT = "Chrome"
+
+# Cached login storage states are refreshed after this many seconds
+DEFAULT_AUTH_TTL_SECONDS = 30 * 60
+
+# A login lock older than this is considered abandoned by a crashed worker
+AUTH_LOCK_TIMEOUT_SECONDS = 5 * 60
+
+# Chromium performance metrics recorded at test boundaries by the resource monitor
+PAGE_METRICS = ("JSHeapUsedSize", "Nodes", "JSEventListeners", "Documents")
+
 # Global variable to store test results
 test_results = []
 
@@ -35,7 +79,10 @@ def log_message(message):
 def capture_screenshot(page, jira_id, status):
     """Capture a screenshot of the page for test evidence"""
     try:
-        filename = f"{jira_id}_{status}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+        # Persistent contexts have no browser, keep the engine out of the filename then
+        browser = page.context.browser
+        prefix = f"{jira_id}_{browser.browser_type.name}" if browser else jira_id
+        filename = f"{prefix}_{status}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
         filepath = os.path.join(SCREENSHOTS_DIR, filename)
         page.screenshot(path=filepath)
         log_message(f"Screenshot captured: {filepath}")
@@ -58,8 +105,337 @@ def get_image_as_base64(image_path):
         log_message(f"Error converting image to base64: {str(e)}")
         return None
 
-def format_xray_json(test_results):
-    """Format test results in Xray JSON format for v1 API"""
+def get_file_as_base64(file_path):
+    """Convert any evidence file to base64 encoding"""
+    try:
+        with open(file_path, "rb") as evidence_file:
+            return base64.b64encode(evidence_file.read()).decode("utf-8")
+    except Exception as e:
+        log_message(f"Error converting file to base64: {str(e)}")
+        return None
+
+def is_ci():
+    """Determine if we're running in CI"""
+    return os.environ.get('CI', 'false').lower() == 'true' or os.environ.get('BITBUCKET_PIPELINE_UUID') is not None
+
+def get_evidence_settings(item):
+    """Resolve trace/video settings for a test from the command line and the xray_evidence marker"""
+    config = item.config
+    settings = {
+        'tracing': config.getoption("xray_tracing"),
+        'video': config.getoption("xray_video"),
+        'screenshots': False,  # Trace screencast frames are the expensive part, keep DOM snapshots only
+        'max_bytes': config.getoption("xray_evidence_max_bytes")
+    }
+    marker = item.get_closest_marker("xray_evidence")
+    if marker:
+        for key, value in marker.kwargs.items():
+            if key not in settings:
+                raise ValueError(f"Unknown xray_evidence option '{key}' on {item.nodeid}")
+            if key in ('tracing', 'video') and value not in EVIDENCE_MODES:
+                raise ValueError(f"xray_evidence {key} on {item.nodeid} must be one of {', '.join(EVIDENCE_MODES)}, got '{value}'")
+            settings[key] = value
+    return settings
+
+def store_evidence_artifacts(item, artifact_paths, max_bytes):
+    """Compress retained trace/video files into the artifacts directory and attach them to the Xray result"""
+    jira_id = next((mark.args[0] for mark in item.iter_markers(name="jira")), None)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    prefix = re.sub(r'[^\w.-]+', '_', f"{jira_id}_{item.name}" if jira_id else item.name)
+    
+    evidence_paths = []
+    total_bytes = 0
+    for artifact_path in artifact_paths:
+        if not os.path.exists(artifact_path):
+            log_message(f"Playwright artifact not found: {artifact_path}")
+            continue
+        
+        filename = os.path.basename(artifact_path)
+        if filename.endswith('.zip'):
+            # Traces are already zip archives, no need to compress them twice
+            archive_path = os.path.join(ARTIFACTS_DIR, f"{prefix}_{timestamp}_{filename}")
+            shutil.move(artifact_path, archive_path)
+        else:
+            archive_path = os.path.join(ARTIFACTS_DIR, f"{prefix}_{timestamp}_{filename}.zip")
+            with zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.write(artifact_path, arcname=filename)
+        log_message(f"Playwright artifact retained: {archive_path}")
+        
+        # Artifacts are ordered by priority (trace first), skip whatever no longer fits the cap
+        size = os.path.getsize(archive_path)
+        if total_bytes + size > max_bytes:
+            log_message(f"Evidence {archive_path} ({size} bytes) exceeds the {max_bytes} bytes evidence cap, not attaching it to Xray")
+            continue
+        total_bytes += size
+        evidence_paths.append(archive_path)
+    
+    # The Xray result is created in pytest_runtest_makereport before fixtures are torn down
+    result_data = getattr(item, '_xray_result', None)
+    if result_data is not None and evidence_paths:
+        result_data.setdefault('evidence_paths', []).extend(evidence_paths)
+        # Iterations are merged into one Xray test, format_xray_json enforces the cap over all of them
+        result_data['evidence_max_bytes'] = max_bytes
+        log_message(f"Added {len(evidence_paths)} Playwright artifacts to test result")
+
+def release_lock_file(lock_path, is_removable):
+    """Atomically move a lock file aside, delete it if is_removable(moved_path) or put it back"""
+    moved_path = f"{lock_path}.{uuid.uuid4().hex}"
+    try:
+        os.rename(lock_path, moved_path)
+    except FileNotFoundError:
+        return False
+    try:
+        if is_removable(moved_path):
+            return True
+        # The lock changed hands in the meantime, restore it unless a new one was already created
+        with contextlib.suppress(FileExistsError):
+            os.link(moved_path, lock_path)
+        return False
+    finally:
+        os.remove(moved_path)
+
+def read_lock_owner(lock_path):
+    """Token written into a lock file by its owner"""
+    with open(lock_path) as f:
+        return f.read()
+
+@contextlib.contextmanager
+def file_lock(lock_path, timeout=AUTH_LOCK_TIMEOUT_SECONDS):
+    """Cross-process lock based on exclusive creation of a lock file holding the owner's token"""
+    token = f"{os.getpid()}-{uuid.uuid4().hex}"
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            try:
+                os.write(fd, token.encode())
+            finally:
+                os.close(fd)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > timeout:
+                    # Only one waiter moves the abandoned lock away, a live lock is put back
+                    if release_lock_file(lock_path, lambda path: time.time() - os.path.getmtime(path) > timeout):
+                        log_message(f"Removed stale lock: {lock_path}")
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.1)
+    
+    # Keep the lock fresh while it is held, so a slow login does not look abandoned
+    stop_event = threading.Event()
+    
+    def heartbeat():
+        while not stop_event.wait(timeout / 3):
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(lock_path)
+    
+    thread = threading.Thread(target=heartbeat, name="xray-lock-heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        thread.join()
+        release_lock_file(lock_path, lambda path: read_lock_owner(path) == token)
+
+def cookie_matches_origin(cookie, origin):
+    """Check whether a cookie is sent to an origin of the storage state"""
+    host = urlparse(origin).hostname or ""
+    domain = cookie.get('domain', "").lstrip('.')
+    return bool(domain) and (host == domain or host.endswith(f".{domain}"))
+
+def is_storage_state_valid(state_path, ttl, cookie_names=None):
+    """Check that a cached storage state exists, is younger than the TTL and its login cookies have not expired"""
+    try:
+        if time.time() - os.path.getmtime(state_path) > ttl:
+            return False
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return False
+    
+    # Short-lived third-party and analytics cookies must not force a new login, only check
+    # the requested cookies or, by default, those of the origins the login flow stored state for
+    origins = [origin['origin'] for origin in state.get('origins', [])]
+    if cookie_names:
+        cookies = [cookie for cookie in state.get('cookies', []) if cookie.get('name') in cookie_names]
+    else:
+        cookies = [
+            cookie for cookie in state.get('cookies', [])
+            if any(cookie_matches_origin(cookie, origin) for origin in origins)
+        ]
+    # Session cookies have expires -1
+    return all(cookie.get('expires', -1) < 0 or cookie['expires'] > time.time() for cookie in cookies)
+
+def get_storage_state_path(state_dir, role):
+    """Cache file of the storage state of a role"""
+    return state_dir / (re.sub(r'[^\w.-]+', '_', role) + ".json")
+
+def get_storage_state(browser, role, state_path, login, ttl, cookie_names=None):
+    """Return the cached storage state of a role and its mtime, logging in first if it is missing or expired"""
+    # Other workers may refresh or invalidate the file at any time, only touch it while holding the lock
+    with file_lock(state_path.with_suffix(".lock")):
+        if not is_storage_state_valid(state_path, ttl, cookie_names):
+            log_message(f"Logging in as '{role}' to refresh the cached storage state")
+            login_context = browser.new_context()
+            try:
+                login(login_context.new_page(), role)
+                temp_path = state_path.with_suffix(".tmp")
+                login_context.storage_state(path=temp_path)
+                os.replace(temp_path, state_path)
+            finally:
+                login_context.close()
+        
+        with open(state_path) as f:
+            return json.load(f), os.path.getmtime(state_path)
+
+def invalidate_storage_state(state_path, state_mtime):
+    """Drop a cached storage state so the next test using the role logs in again"""
+    with file_lock(state_path.with_suffix(".lock")):
+        try:
+            # Another worker already refreshed the state this context was created from
+            if os.path.getmtime(state_path) > state_mtime:
+                return False
+            os.remove(state_path)
+        except FileNotFoundError:
+            return False
+    log_message(f"Cached storage state invalidated: {state_path}")
+    return True
+
+def sample_process_tree():
+    """Sum CPU time and RSS over the Playwright driver and browser processes started by this process"""
+    sample = {'cpu_seconds': 0.0, 'rss_bytes': 0, 'processes': 0}
+    for process in psutil.Process(os.getpid()).children(recursive=True):
+        try:
+            with process.oneshot():
+                cpu_times = process.cpu_times()
+                sample['cpu_seconds'] += cpu_times.user + cpu_times.system
+                sample['rss_bytes'] += process.memory_info().rss
+                sample['processes'] += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            # Renderers come and go while the test runs
+            continue
+    return sample
+
+def start_resource_sampler(interval):
+    """Sample the process tree in a background thread until the returned event is set"""
+    samples = [sample_process_tree()]
+    stop_event = threading.Event()
+    
+    def run():
+        while not stop_event.wait(interval):
+            samples.append(sample_process_tree())
+    
+    thread = threading.Thread(target=run, name="xray-resource-sampler", daemon=True)
+    thread.start()
+    return thread, stop_event, samples
+
+def get_page_metrics(page):
+    """Read Chromium performance metrics of a page, None for other engines or closed pages"""
+    # Persistent contexts have no browser, CDP metrics are only read from regular Chromium contexts
+    if page is None or page.is_closed() or page.context.browser is None:
+        return None
+    if page.context.browser.browser_type.name != "chromium":
+        return None
+    try:
+        session = page.context.new_cdp_session(page)
+        try:
+            session.send("Performance.enable")
+            metrics = session.send("Performance.getMetrics")["metrics"]
+        finally:
+            session.detach()
+        return {metric['name']: metric['value'] for metric in metrics if metric['name'] in PAGE_METRICS}
+    except Exception as e:
+        log_message(f"Error reading page metrics: {str(e)}")
+        return None
+
+def summarize_resource_usage(samples, page_metrics_start, page_metrics_end, config):
+    """Reduce resource samples of a test to a compact dict and flag threshold violations"""
+    first, last = samples[0], samples[-1]
+    usage = {
+        # CPU time of processes that exited during the test is lost, so never report a negative value
+        'cpu_seconds': round(max(last['cpu_seconds'] - first['cpu_seconds'], 0.0), 2),
+        'peak_rss_mb': round(max(sample['rss_bytes'] for sample in samples) / (1024 * 1024), 1),
+        'rss_delta_mb': round((last['rss_bytes'] - first['rss_bytes']) / (1024 * 1024), 1),
+        'peak_processes': max(sample['processes'] for sample in samples),
+        'samples': len(samples),
+        'exceeded': []
+    }
+    if page_metrics_end:
+        usage['page_metrics'] = page_metrics_end
+        if page_metrics_start:
+            usage['page_metrics_delta'] = {
+                name: page_metrics_end[name] - page_metrics_start[name]
+                for name in page_metrics_end if name in page_metrics_start
+            }
+    
+    max_rss_mb = config.getoption("xray_max_rss_mb")
+    if max_rss_mb is not None and usage['peak_rss_mb'] > max_rss_mb:
+        usage['exceeded'].append(f"peak RSS {usage['peak_rss_mb']} MB > {max_rss_mb} MB")
+    max_cpu_seconds = config.getoption("xray_max_cpu_seconds")
+    if max_cpu_seconds is not None and usage['cpu_seconds'] > max_cpu_seconds:
+        usage['exceeded'].append(f"CPU {usage['cpu_seconds']}s > {max_cpu_seconds}s")
+    return usage
+
+def format_resource_summary(usage):
+    """One-line resource summary for the Xray iteration log"""
+    summary = (
+        f"Resources: CPU {usage['cpu_seconds']}s, peak RSS {usage['peak_rss_mb']} MB "
+        f"({usage['rss_delta_mb']:+} MB), {usage['peak_processes']} processes"
+    )
+    if 'page_metrics' in usage:
+        heap_mb = usage['page_metrics'].get('JSHeapUsedSize', 0) / (1024 * 1024)
+        summary += f", JS heap {heap_mb:.1f} MB, {int(usage['page_metrics'].get('Nodes', 0))} DOM nodes"
+    if usage['exceeded']:
+        summary += f" - THRESHOLD EXCEEDED: {'; '.join(usage['exceeded'])}"
+    return summary
+
+def write_resource_report(test_results):
+    """Write the run-level resource report, heaviest tests first"""
+    entries = [
+        {'jira_id': result['jira_id'], 'status': result['status'], 'browser': result.get('browser'), **result['resource_usage']}
+        for result in test_results if 'resource_usage' in result
+    ]
+    if not entries:
+        return None
+    entries.sort(key=lambda entry: entry['peak_rss_mb'], reverse=True)
+    
+    report = {
+        'generated': datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'tests': len(entries),
+        'total_cpu_seconds': round(sum(entry['cpu_seconds'] for entry in entries), 2),
+        'peak_rss_mb': entries[0]['peak_rss_mb'],
+        'flagged': [entry['test'] for entry in entries if entry['exceeded']],
+        'results': entries
+    }
+    
+    filename = f"logs/resource_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    try:
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2)
+        log_message(f"Resource report saved to: {filename}")
+        for entry in entries[:5]:
+            log_message(f"  {entry['test']}: peak RSS {entry['peak_rss_mb']} MB, CPU {entry['cpu_seconds']}s")
+        if report['flagged']:
+            log_message(f"{len(report['flagged'])} tests exceeded resource thresholds: {', '.join(report['flagged'])}")
+        return filename
+    except Exception as e:
+        log_message(f"Error saving resource report: {str(e)}")
+        return None
+
+def group_results_by_environment(test_results, default_browser=None):
+    """Split test results per Xray test environment, each one is imported as its own execution"""
+    # Results without a browser engine (non-browser tests) go to the default browser's environment
+    default_environment = BROWSER_ENVIRONMENTS.get(default_browser, DEFAULT_TEST_ENVIRONMENT)
+    grouped = {}
+    for result in test_results:
+        test_environment = BROWSER_ENVIRONMENTS.get(result.get('browser'), default_environment)
+        grouped.setdefault(test_environment, []).append(result)
+    return grouped
+
+def format_xray_json(test_results, test_environment=DEFAULT_TEST_ENVIRONMENT):
+    """Format test results of one test environment in Xray JSON format for v1 API"""
     # Format datetime in ISO 8601 format with Z suffix for UTC time
     current_time = datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%S.%fZ").replace('.000000Z', 'Z')
     # Extract project key from first test case ID
@@ -78,7 +454,10 @@ def format_xray_json(test_results):
                 'comment': f"Test execution completed with status: {result['status']}",
                 'iterations': [],
                 'has_failure': False,  # Track if any iteration failed
-                'screenshot_paths': []  # Track screenshots for test evidences
+                'screenshot_paths': [],  # Track screenshots for test evidences
+                'evidence_paths': [],  # Track Playwright traces/videos for test evidences
+                'evidence_max_bytes': DEFAULT_EVIDENCE_MAX_BYTES,  # Size cap of the traces/videos of the test
+                'resource_summaries': []  # Track resource usage of non-parameterized runs
             }
         
         # Track if any iteration failed
@@ -92,6 +471,15 @@ def format_xray_json(test_results):
         if 'screenshot_paths' in result and result['screenshot_paths']:
             grouped_results[jira_id]['screenshot_paths'].extend(result['screenshot_paths'])
         
+        if 'evidence_paths' in result and result['evidence_paths']:
+            grouped_results[jira_id]['evidence_paths'].extend(result['evidence_paths'])
+            grouped_results[jira_id]['evidence_max_bytes'] = min(
+                grouped_results[jira_id]['evidence_max_bytes'],
+                result.get('evidence_max_bytes', DEFAULT_EVIDENCE_MAX_BYTES)
+            )
+        
+        resource_summary = format_resource_summary(result['resource_usage']) if 'resource_usage' in result else None
+        
         # Add iteration if parameters exist
         if 'parameters' in result:
             iteration = {
@@ -106,7 +494,11 @@ def format_xray_json(test_results):
                 'status': result['status'],
                 'log': f"Test execution completed with status: {result['status']}"
             }
+            if resource_summary:
+                iteration['log'] += f"\n{resource_summary}"
             grouped_results[jira_id]['iterations'].append(iteration)
+        elif resource_summary:
+            grouped_results[jira_id]['resource_summaries'].append(resource_summary)
     
     # Convert grouped results to Xray format
     tests = []
@@ -116,6 +508,9 @@ def format_xray_json(test_results):
             result['status'] = 'FAILED'
             result['comment'] = "Test execution FAILED - One or more iterations failed"
         
+        if result['resource_summaries']:
+            result['comment'] += "\n" + "\n".join(result['resource_summaries'])
+        
         test_data = {
             "testKey": result['jira_id'],
             "start": result['start_time'],
@@ -125,20 +520,35 @@ def format_xray_json(test_results):
         }
         
         # Add evidences if screenshot paths exist
-        if result['screenshot_paths']:
-            evidences = []
-            for path in result['screenshot_paths']:
-                image_data = get_image_as_base64(path)
-                if image_data:
-                    filename = os.path.basename(path)
-                    evidences.append({
-                        "data": image_data,
-                        "filename": filename,
-                        "contentType": "image/png"
-                    })
-            
-            if evidences:
-                test_data["evidences"] = evidences
+        evidences = []
+        for path in result['screenshot_paths']:
+            image_data = get_image_as_base64(path)
+            if image_data:
+                filename = os.path.basename(path)
+                evidences.append({
+                    "data": image_data,
+                    "filename": filename,
+                    "contentType": "image/png"
+                })
+        
+        # Add retained Playwright traces/videos as evidences, bounded over all iterations of the test
+        evidence_bytes = 0
+        for path in result['evidence_paths']:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if evidence_bytes + size > result['evidence_max_bytes']:
+                log_message(f"Evidence {path} ({size} bytes) exceeds the {result['evidence_max_bytes']} bytes evidence cap of {result['jira_id']}, not attaching it to Xray")
+                continue
+            evidence_bytes += size
+            file_data = get_file_as_base64(path)
+            if file_data:
+                evidences.append({
+                    "data": file_data,
+                    "filename": os.path.basename(path),
+                    "contentType": mimetypes.guess_type(path)[0] or "application/octet-stream"
+                })
+        
+        if evidences:
+            test_data["evidences"] = evidences
         
         # Add iterations if they exist
         if result['iterations']:
@@ -156,7 +566,7 @@ def format_xray_json(test_results):
             "project": project_key,
             "version": "1.0",
             "revision": "1.0",
-            "testEnvironments": ["Chrome"]
+            "testEnvironments": [test_environment]
         },
         "tests": tests
     }
@@ -188,8 +598,8 @@ def get_xray_cloud_token():
         log_message(f"Error during Xray Cloud authentication: {str(e)}")
         return None
 
-def upload_to_xray_cloud(test_results):
-    """Upload test execution results to Xray Cloud API v1"""
+def upload_to_xray_cloud(test_results, test_environment=DEFAULT_TEST_ENVIRONMENT):
+    """Upload test execution results of one test environment to Xray Cloud API v1"""
     if not test_results:
         log_message("No test results to upload to Xray Cloud")
         return False
@@ -198,10 +608,10 @@ def upload_to_xray_cloud(test_results):
     if not token:
         log_message("Cannot upload results to Xray Cloud: authentication failed")
         # Save results locally even if authentication failed
-        save_results_locally(test_results)
+        save_results_locally(test_results, test_environment)
         return False
     
-    data = format_xray_json(test_results)
+    data = format_xray_json(test_results, test_environment)
     upload_url = f"{XRAY_CLOUD_BASE_URL}/import/execution"
     headers = {
         'Content-Type': 'application/json',
@@ -209,7 +619,7 @@ def upload_to_xray_cloud(test_results):
     }
     
     try:
-        log_message("\nUploading test results to Xray Cloud...")
+        log_message(f"\nUploading {test_environment} test results to Xray Cloud...")
         log_message(f"Upload URL: {upload_url}")
         log_message(f"Using API version: v1")
         
@@ -231,27 +641,27 @@ def upload_to_xray_cloud(test_results):
             log_message(f"Error uploading results to Xray Cloud: {status_code}")
             log_message(f"Response: {response.text}")
             # Save results locally if upload failed
-            save_results_locally(test_results)
+            save_results_locally(test_results, test_environment)
             return False
     except Exception as e:
         log_message(f"Error during Xray Cloud upload: {str(e)}")
         # Save results locally if an exception occurred
-        save_results_locally(test_results)
+        save_results_locally(test_results, test_environment)
         return False
 
-def save_results_locally(test_results):
+def save_results_locally(test_results, test_environment=DEFAULT_TEST_ENVIRONMENT):
     """Save test results locally when they can't be uploaded to Xray"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"logs/test_results_{timestamp}.json"
+    filename = f"logs/test_results_{timestamp}_{test_environment}.json"
     
     try:
-        data = format_xray_json(test_results)
+        data = format_xray_json(test_results, test_environment)
         with open(filename, 'w') as f:
             json.dump(data, f, indent=2)
         log_message(f"Test results saved locally to: {filename}")
         
         # Also save the raw test results for debugging
-        debug_filename = f"logs/test_results_raw_{timestamp}.json"
+        debug_filename = f"logs/test_results_raw_{timestamp}_{test_environment}.json"
         
         # Create a safe version without binary data for debugging
         safe_results = []
@@ -272,7 +682,7 @@ def save_results_locally(test_results):
             for evidence in test.get('evidences', []):
                 if 'data' in evidence and 'filename' in evidence:
                     try:
-                        evidence_filename = f"logs/evidence_{test['testKey']}_{timestamp}_{evidence['filename']}"
+                        evidence_filename = f"logs/evidence_{test['testKey']}_{test_environment}_{timestamp}_{evidence['filename']}"
                         with open(evidence_filename, 'wb') as f:
                             f.write(base64.b64decode(evidence['data']))
                         log_message(f"Evidence saved to: {evidence_filename}")
@@ -282,13 +692,290 @@ def save_results_locally(test_results):
     except Exception as e:
         log_message(f"Error saving test results locally: {str(e)}")
 
+def pytest_addoption(parser):
+    """Register Playwright evidence options"""
+    group = parser.getgroup("xray", "Xray Cloud integration")
+    group.addoption(
+        "--xray-tracing",
+        choices=EVIDENCE_MODES,
+        default="retain-on-failure",
+        help="Record Playwright traces for tests using the browser fixtures (default: retain-on-failure)"
+    )
+    group.addoption(
+        "--xray-video",
+        choices=EVIDENCE_MODES,
+        default="off",
+        help="Record Playwright videos for tests using the browser fixtures (default: off)"
+    )
+    group.addoption(
+        "--xray-evidence-max-bytes",
+        type=int,
+        default=DEFAULT_EVIDENCE_MAX_BYTES,
+        help="Maximum size of the trace/video evidences attached to a single Xray test"
+    )
+    group.addoption(
+        "--xray-browsers",
+        default=None,
+        help="Comma separated Playwright engines to run the browser fixture tests on, "
+             "e.g. chromium,firefox,webkit - each one is reported as its own Xray test environment"
+    )
+    group.addoption(
+        "--xray-auth-scope",
+        choices=("run", "worker"),
+        default="run",
+        help="Share cached login storage states across xdist workers (run) or log in once per worker (worker)"
+    )
+    group.addoption(
+        "--xray-auth-ttl",
+        type=int,
+        default=DEFAULT_AUTH_TTL_SECONDS,
+        help="Seconds before a cached login storage state is refreshed (default: 1800)"
+    )
+    group.addoption(
+        "--xray-auth-cookies",
+        default=None,
+        help="Comma separated login cookie names whose expiry refreshes a cached storage state "
+             "(default: cookies of the origins stored by the login flow)"
+    )
+    group.addoption(
+        "--xray-resource-monitor",
+        action="store_true",
+        default=False,
+        help="Record CPU/RSS of the browser process tree and page metrics for jira tests (requires psutil)"
+    )
+    group.addoption(
+        "--xray-resource-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between resource samples taken during a test (default: 1.0)"
+    )
+    group.addoption(
+        "--xray-max-rss-mb",
+        type=float,
+        default=None,
+        help="Flag tests whose browser process tree peaks above this RSS in MB"
+    )
+    group.addoption(
+        "--xray-max-cpu-seconds",
+        type=float,
+        default=None,
+        help="Flag tests whose browser process tree uses more CPU seconds than this"
+    )
+
 def pytest_configure(config):
-    """Register the jira marker"""
+    """Register the plugin markers and validate the plugin options"""
     config.addinivalue_line("markers", "jira: mark test as associated with a Jira test case")
+    config.addinivalue_line(
+        "markers",
+        "xray_evidence(tracing=None, video=None, screenshots=False, max_bytes=None): "
+        "override Playwright trace/video recording for a test"
+    )
+    config.addinivalue_line(
+        "markers",
+        "auth_role(role): run the test in a context restored from the cached login storage state of role"
+    )
+    unknown = [name for name in get_browser_names(config) if name not in BROWSER_ENVIRONMENTS]
+    if unknown:
+        raise pytest.UsageError(
+            f"Unknown --xray-browsers engine(s): {', '.join(unknown)} - use {', '.join(BROWSER_ENVIRONMENTS)}"
+        )
+    if config.getoption("xray_resource_monitor") and psutil is None:
+        raise pytest.UsageError("--xray-resource-monitor requires psutil, install it with: pip install psutil")
+    if config.getoption("xray_resource_interval") <= 0:
+        raise pytest.UsageError("--xray-resource-interval must be greater than 0")
+
+def get_browser_names(config):
+    """Browser engines requested with --xray-browsers"""
+    browsers = config.getoption("xray_browsers") or ""
+    return [name.strip() for name in browsers.split(",") if name.strip()]
+
+# Must run before xdist's loadgroup hook reads the xdist_group markers
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    """Validate xray_evidence markers and run each --xray-browsers engine in one xdist worker"""
+    # Report bad markers once as a usage error instead of a setup error in every test
+    for item in items:
+        if item.get_closest_marker("xray_evidence"):
+            try:
+                get_evidence_settings(item)
+            except ValueError as e:
+                raise pytest.UsageError(str(e))
+    
+    browsers = get_browser_names(config)
+    if not browsers:
+        return
+    
+    def get_item_browser(item):
+        callspec = getattr(item, 'callspec', None)
+        return callspec.params.get('browser_name') if callspec else None
+    
+    # Keep the tests of one engine together, the session-scoped browser is relaunched on every switch
+    order = {name: index for index, name in enumerate(browsers)}
+    items.sort(key=lambda item: order.get(get_item_browser(item), -1))
+    if config.pluginmanager.hasplugin("xdist"):
+        for item in items:
+            browser_name = get_item_browser(item)
+            if browser_name:
+                item.add_marker(pytest.mark.xdist_group(browser_name))
+
+def pytest_generate_tests(metafunc):
+    """Fan tests using the browser fixtures out across the --xray-browsers engines"""
+    browsers = get_browser_names(metafunc.config)
+    if browsers and "browser_name" in metafunc.fixturenames:
+        metafunc.parametrize("browser_name", browsers, scope="session")
+
+@pytest.fixture(scope="session")
+def browser_name():
+    """Playwright browser engine used by the browser fixtures"""
+    return "chromium"
+
+@pytest.fixture(scope="session")
+def playwright():
+    """Playwright instance shared by all tests of the session"""
+    with sync_playwright() as p:
+        yield p
+
+@pytest.fixture(scope="session")
+def browser(playwright, browser_name):
+    """Browser launched once per session - headless in CI, regular in dev"""
+    browser = getattr(playwright, browser_name).launch(headless=is_ci())
+    yield browser
+    browser.close()
+
+def get_auth_cookie_names(config):
+    """Login cookie names requested with --xray-auth-cookies"""
+    cookies = config.getoption("xray_auth_cookies") or ""
+    return [name.strip() for name in cookies.split(",") if name.strip()]
+
+@pytest.fixture(scope="session")
+def auth_login():
+    """Login flow for cached storage states - override it in conftest.py with a callable(page, role)"""
+    return None
+
+@pytest.fixture(scope="session")
+def auth_state_dir(request, tmp_path_factory):
+    """Directory holding the cached login storage states"""
+    state_dir = tmp_path_factory.getbasetemp()
+    # xdist workers get their own basetemp under a directory shared by the whole run
+    if hasattr(request.config, 'workerinput') and request.config.getoption("xray_auth_scope") == "run":
+        state_dir = state_dir.parent
+    state_dir = state_dir / "auth-states"
+    state_dir.mkdir(exist_ok=True)
+    return state_dir
+
+@pytest.fixture
+def context(browser, request, tmp_path):
+    """Fresh browser context per test, recording traces/videos that are only kept on failure"""
+    settings = get_evidence_settings(request.node)
+    recording_dir = tmp_path / "playwright"
+    
+    context_args = {}
+    if settings['video'] != 'off':
+        context_args['record_video_dir'] = str(recording_dir / "videos")
+    
+    # Restore the logged in state of the auth_role instead of logging in again
+    auth_marker = request.node.get_closest_marker("auth_role")
+    state_path = None
+    if auth_marker:
+        login = request.getfixturevalue("auth_login")
+        if login is None:
+            raise pytest.UsageError("auth_role marker used but no auth_login fixture is defined in conftest.py")
+        state_path = get_storage_state_path(request.getfixturevalue("auth_state_dir"), auth_marker.args[0])
+        state, state_mtime = get_storage_state(
+            browser,
+            auth_marker.args[0],
+            state_path,
+            login,
+            request.config.getoption("xray_auth_ttl"),
+            get_auth_cookie_names(request.config)
+        )
+        context_args['storage_state'] = state
+    
+    context = browser.new_context(**context_args)
+    if state_path:
+        # An unauthorized page load means the session expired server side,
+        # third-party subresources answering 401 say nothing about our login
+        invalidated = []
+        def on_response(response):
+            if (response.status == 401 and not invalidated
+                    and response.request.resource_type == "document"
+                    and response.frame.parent_frame is None):
+                invalidated.append(invalidate_storage_state(state_path, state_mtime))
+        context.on("response", on_response)
+    # Track pages as they open, tests may close them before teardown
+    pages = []
+    context.on("page", pages.append)
+    if settings['tracing'] != 'off':
+        context.tracing.start(screenshots=settings['screenshots'], snapshots=True, sources=False)
+    
+    yield context
+    
+    failed = getattr(request.node, '_xray_failed', False)
+    retain = {
+        kind: settings[kind] == 'on' or (settings[kind] == 'retain-on-failure' and failed)
+        for kind in ('tracing', 'video')
+    }
+    
+    artifact_paths = []
+    try:
+        if settings['tracing'] != 'off':
+            if retain['tracing']:
+                trace_path = recording_dir / "trace.zip"
+                context.tracing.stop(path=trace_path)
+                artifact_paths.append(str(trace_path))
+            else:
+                # Stopping without a path discards the recorded trace
+                context.tracing.stop()
+        
+        videos = [page.video for page in pages if page.video]
+        context.close()
+        if retain['video']:
+            artifact_paths.extend(str(video.path()) for video in videos)
+        
+        if artifact_paths:
+            store_evidence_artifacts(request.node, artifact_paths, settings['max_bytes'])
+    except Exception as e:
+        log_message(f"Error collecting Playwright artifacts: {str(e)}")
+    finally:
+        # Passed tests leave nothing behind
+        shutil.rmtree(recording_dir, ignore_errors=True)
+
+@pytest.fixture
+def page(context):
+    """New page in the per-test browser context"""
+    return context.new_page()
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    """Sample browser resources around jira tests when the resource monitor is enabled"""
+    jira_id = next((mark.args[0] for mark in item.iter_markers(name="jira")), None)
+    if not jira_id or not item.config.getoption("xray_resource_monitor"):
+        yield
+        return
+    
+    page = getattr(item, 'funcargs', {}).get('page')
+    page_metrics_start = get_page_metrics(page)
+    thread, stop_event, samples = start_resource_sampler(item.config.getoption("xray_resource_interval"))
+    try:
+        yield
+    finally:
+        stop_event.set()
+        thread.join()
+        samples.append(sample_process_tree())
+        # Read the final page metrics before fixture teardown closes the page
+        usage = summarize_resource_usage(samples, page_metrics_start, get_page_metrics(page), item.config)
+        usage['test'] = item.nodeid
+        item._xray_resource_usage = usage
+        if usage['exceeded']:
+            log_message(f"Test {jira_id} exceeded resource thresholds: {'; '.join(usage['exceeded'])}")
 
 @pytest.hookimpl(tryfirst=True)
 def pytest_runtest_makereport(item, call):
     """Collect test results"""
+    # Remember failures of any phase so the browser fixtures know whether to keep their artifacts
+    if call.excinfo is not None and not call.excinfo.errisinstance(pytest.skip.Exception):
+        item._xray_failed = True
+    
     if call.when == "call":  # Only process the test after it's completed
         jira_id = next((mark.args[0] for mark in item.iter_markers(name="jira")), None)
         if jira_id:
@@ -309,7 +996,12 @@ def pytest_runtest_makereport(item, call):
             screenshot_paths = []
             
             # Method 1: Try to capture screenshot directly if test failed
-            if status == 'FAILED' and hasattr(item, '_obj') and hasattr(item._obj, '__globals__'):
+            page = getattr(item, 'funcargs', {}).get('page')
+            if status == 'FAILED' and page is not None and hasattr(page, 'screenshot'):
+                screenshot_path = capture_screenshot(page, jira_id, status)
+                if screenshot_path:
+                    screenshot_paths.append(screenshot_path)
+            elif status == 'FAILED' and hasattr(item, '_obj') and hasattr(item._obj, '__globals__'):
                 globals_dict = item._obj.__globals__
                 if 'page' in globals_dict and hasattr(globals_dict['page'], 'screenshot'):
                     screenshot_path = capture_screenshot(globals_dict['page'], jira_id, status)
@@ -317,30 +1009,11 @@ def pytest_runtest_makereport(item, call):
                         screenshot_paths.append(screenshot_path)
             
             # Method 2: Check for _test_screenshots in the test module
-            if hasattr(item.module, '_test_screenshots'):
-                test_screenshots = item.module._test_screenshots
-                test_name = item.name
-                
-                # Handle parameterized tests
-                base_name = test_name.split('[')[0] if '[' in test_name else test_name
-                
-                # First check if we have a direct match for the test name (including parameters)
-                if test_name in test_screenshots:
-                    screenshot_paths.extend(test_screenshots[test_name])
-                    log_message(f"Found screenshots for exact test {test_name}")
-                # Next try to match by base name
-                elif base_name in test_screenshots:
-                    screenshot_paths.extend(test_screenshots[base_name])
-                    log_message(f"Found screenshots for test {base_name}")
-                # Finally look for parameterized versions if this is a failing test
-                elif status == 'FAILED':
-                    # Look through all keys to find those that start with our base name
-                    for key in test_screenshots:
-                        if key.startswith(f"{base_name}_"):
-                            # Check if this key contains our parameters
-                            if any(param in key for param in item.callspec.id.split('-') if param):
-                                screenshot_paths.extend(test_screenshots[key])
-                                log_message(f"Found screenshots for parameterized test {key}")
+            # (save_screenshot keys them by node id, which is unique per parameter set and browser)
+            test_screenshots = getattr(item.module, '_test_screenshots', {})
+            if item.nodeid in test_screenshots:
+                screenshot_paths.extend(test_screenshots[item.nodeid])
+                log_message(f"Found screenshots for test {item.nodeid}")
             
             # Add screenshot paths to result data if available
             if screenshot_paths:
@@ -348,19 +1021,50 @@ def pytest_runtest_makereport(item, call):
                 log_message(f"Added {len(screenshot_paths)} screenshots to test result")
             
             # Add parameters if the test is parameterized
-            if hasattr(item, 'funcargs'):
+            # (only parametrize values - fixtures such as page or context are not test parameters)
+            if hasattr(item, 'callspec'):
                 parameters = {}
-                for param_name, param_value in item.funcargs.items():
-                    if param_name not in ['request', 'item']:  # Skip internal pytest parameters
+                for param_name, param_value in item.callspec.params.items():
+                    if param_name != 'browser_name':  # Browsers are reported as test environments
                         parameters[param_name] = str(param_value)
                 if parameters:
                     result_data['parameters'] = parameters
             
+            # Remember the browser engine to report the result in the right test environment
+            browser_name = getattr(item, 'funcargs', {}).get('browser_name')
+            if browser_name:
+                result_data['browser'] = browser_name
+            
+            # Add resource usage sampled by pytest_runtest_call
+            if hasattr(item, '_xray_resource_usage'):
+                result_data['resource_usage'] = item._xray_resource_usage
+            
             test_results.append(result_data)
+            # Keep a reference so fixture teardown can attach trace/video evidences
+            item._xray_result = result_data
             log_message(f"\nTest {jira_id} completed with status: {status}")
 
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    """Collect the test results of a finished xdist worker on the controller"""
+    worker_results = getattr(node, 'workeroutput', {}).get('xray_test_results')
+    if worker_results:
+        test_results.extend(json.loads(worker_results))
+
 def pytest_sessionfinish(session, exitstatus):
     """Handle test results upload after all tests are completed"""
+    # xdist workers hand their results to the controller, which uploads them once
+    if hasattr(session.config, 'workeroutput'):
+        session.config.workeroutput['xray_test_results'] = json.dumps(test_results)
+        return
+    
     if test_results:
-        # Upload test results to Xray Cloud
-        upload_to_xray_cloud(test_results) 
\ No newline at end of file
+        if session.config.getoption("xray_resource_monitor"):
+            write_resource_report(test_results)
+        
+        # Upload test results to Xray Cloud - one execution per test environment
+        # In matrix mode, results without a browser are reported under the first requested engine
+        browsers = get_browser_names(session.config)
+        grouped_results = group_results_by_environment(test_results, browsers[0] if browsers else None)
+        for test_environment, environment_results in grouped_results.items():
+            upload_to_xray_cloud(environment_results, test_environment) 
\ No newline at end of file
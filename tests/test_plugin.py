@@ -0,0 +1,507 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import pytest_jira_plugin_screenshots as plugin
+
+
+def make_result(jira_id, status, browser=None, parameters=None):
+    """Build a test result the way pytest_runtest_makereport records it"""
+    result = {
+        'jira_id': jira_id,
+        'status': status,
+        'start_time': "2025-03-17T18:08:43Z",
+        'finish_time': "2025-03-17T18:08:44Z"
+    }
+    if browser:
+        result['browser'] = browser
+    if parameters:
+        result['parameters'] = parameters
+    return result
+
+
+@pytest.fixture
+def test_results(monkeypatch):
+    """Isolate the plugin's global results from the results of this session"""
+    results = []
+    monkeypatch.setattr(plugin, 'test_results', results)
+    return results
+
+
+def test_results_are_grouped_by_test_environment():
+    results = [
+        make_result('SCRUM-1', 'PASSED', 'chromium'),
+        make_result('SCRUM-1', 'PASSED', 'firefox'),
+        make_result('SCRUM-1', 'FAILED', 'webkit'),
+        make_result('SCRUM-2', 'PASSED')
+    ]
+
+    grouped = plugin.group_results_by_environment(results)
+
+    assert sorted(grouped) == ['Chrome', 'Firefox', 'WebKit']
+    # Results without a browser engine keep reporting to the default environment
+    assert [result['jira_id'] for result in grouped['Chrome']] == ['SCRUM-1', 'SCRUM-2']
+    assert [result['status'] for result in grouped['WebKit']] == ['FAILED']
+
+
+def test_results_without_browser_follow_the_requested_engines():
+    results = [make_result('SCRUM-1', 'PASSED', 'firefox'), make_result('SCRUM-1', 'PASSED', 'webkit'), make_result('SCRUM-2', 'PASSED')]
+
+    # With --xray-browsers firefox,webkit no Chrome execution may be created
+    grouped = plugin.group_results_by_environment(results, default_browser='firefox')
+
+    assert sorted(grouped) == ['Firefox', 'WebKit']
+    assert [result['jira_id'] for result in grouped['Firefox']] == ['SCRUM-1', 'SCRUM-2']
+
+
+def test_status_is_rolled_up_per_test_environment():
+    results = []
+    for browser in ('chromium', 'webkit'):
+        for n in ('1', '2'):
+            status = 'FAILED' if (browser, n) == ('webkit', '2') else 'PASSED'
+            results.append(make_result('SCRUM-17', status, browser, {'n': n}))
+
+    executions = {
+        test_environment: plugin.format_xray_json(environment_results, test_environment)
+        for test_environment, environment_results in plugin.group_results_by_environment(results).items()
+    }
+
+    assert executions['Chrome']['info']['testEnvironments'] == ['Chrome']
+    assert executions['Chrome']['tests'][0]['status'] == 'PASSED'
+    assert executions['WebKit']['info']['testEnvironments'] == ['WebKit']
+    assert executions['WebKit']['tests'][0]['status'] == 'FAILED'
+    assert [iteration['status'] for iteration in executions['WebKit']['tests'][0]['iterations']] == ['PASSED', 'FAILED']
+
+
+def test_worker_results_are_handed_to_the_controller(test_results):
+    worker_results = [make_result('SCRUM-1', 'PASSED', 'firefox'), make_result('SCRUM-2', 'FAILED', 'firefox')]
+    test_results.extend(worker_results)
+    worker_session = SimpleNamespace(config=SimpleNamespace(workeroutput={}))
+
+    plugin.pytest_sessionfinish(worker_session, 0)
+
+    # The controller starts with no results of its own
+    test_results.clear()
+    node = SimpleNamespace(workeroutput=worker_session.config.workeroutput)
+    plugin.pytest_testnodedown(node, None)
+
+    assert test_results == json.loads(json.dumps(worker_results))
+
+
+def test_crashed_worker_without_output_is_ignored(test_results):
+    plugin.pytest_testnodedown(SimpleNamespace(), "worker crashed")
+
+    assert test_results == []
+
+
+def write_storage_state(state_path, cookies, age=0, origins=()):
+    """Write a storage state file as saved by BrowserContext.storage_state, aged by age seconds"""
+    state = {'cookies': cookies, 'origins': [{'origin': origin, 'localStorage': []} for origin in origins]}
+    state_path.write_text(json.dumps(state))
+    mtime = time.time() - age
+    os.utime(state_path, (mtime, mtime))
+
+
+def test_storage_state_is_valid_within_ttl(tmp_path):
+    state_path = tmp_path / "admin.json"
+    write_storage_state(state_path, [{'name': 'session', 'expires': -1}, {'name': 'token', 'expires': time.time() + 60}])
+
+    assert plugin.is_storage_state_valid(state_path, ttl=60)
+
+
+def test_storage_state_expires_after_ttl(tmp_path):
+    state_path = tmp_path / "admin.json"
+    write_storage_state(state_path, [], age=120)
+
+    assert not plugin.is_storage_state_valid(state_path, ttl=60)
+
+
+def test_storage_state_with_expired_login_cookie_is_invalid(tmp_path):
+    state_path = tmp_path / "admin.json"
+    write_storage_state(
+        state_path,
+        [{'name': 'token', 'domain': ".example.com", 'expires': time.time() - 1}],
+        origins=["https://app.example.com"]
+    )
+
+    assert not plugin.is_storage_state_valid(state_path, ttl=60)
+
+
+def test_expired_third_party_cookie_keeps_storage_state_valid(tmp_path):
+    state_path = tmp_path / "admin.json"
+    write_storage_state(
+        state_path,
+        [
+            {'name': 'token', 'domain': "app.example.com", 'expires': time.time() + 600},
+            {'name': '_gat', 'domain': ".analytics.example.net", 'expires': time.time() - 1}
+        ],
+        origins=["https://app.example.com"]
+    )
+
+    assert plugin.is_storage_state_valid(state_path, ttl=60)
+
+
+def test_only_requested_cookie_names_are_checked(tmp_path):
+    state_path = tmp_path / "admin.json"
+    write_storage_state(
+        state_path,
+        [
+            {'name': 'session', 'domain': "app.example.com", 'expires': time.time() + 600},
+            {'name': '_gat', 'domain': "app.example.com", 'expires': time.time() - 1}
+        ],
+        origins=["https://app.example.com"]
+    )
+
+    assert plugin.is_storage_state_valid(state_path, ttl=60, cookie_names=["session"])
+    assert not plugin.is_storage_state_valid(state_path, ttl=60, cookie_names=["session", "_gat"])
+
+
+def test_missing_or_corrupt_storage_state_is_invalid(tmp_path):
+    state_path = tmp_path / "admin.json"
+    assert not plugin.is_storage_state_valid(state_path, ttl=60)
+
+    state_path.write_text("{")
+    assert not plugin.is_storage_state_valid(state_path, ttl=60)
+
+
+def test_file_lock_recovers_stale_lock(tmp_path):
+    lock_path = tmp_path / "admin.lock"
+    lock_path.touch()
+    stale = time.time() - 120
+    os.utime(lock_path, (stale, stale))
+
+    with plugin.file_lock(lock_path, timeout=60):
+        assert lock_path.exists()
+
+    assert not lock_path.exists()
+
+
+def test_file_lock_waits_for_active_lock(tmp_path):
+    lock_path = tmp_path / "admin.lock"
+    lock_path.touch()
+    threading.Timer(0.3, lock_path.unlink).start()
+
+    started = time.time()
+    with plugin.file_lock(lock_path, timeout=60):
+        assert time.time() - started >= 0.2
+
+
+def test_stale_lock_is_broken_by_a_single_waiter(tmp_path):
+    lock_path = tmp_path / "admin.lock"
+    lock_path.write_text("crashed-worker")
+    stale = time.time() - 120
+    os.utime(lock_path, (stale, stale))
+    holders = []
+    overlaps = []
+
+    def acquire():
+        with plugin.file_lock(lock_path, timeout=60):
+            holders.append(1)
+            overlaps.append(len(holders))
+            time.sleep(0.05)
+            holders.pop()
+
+    threads = [threading.Thread(target=acquire) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(overlaps) == 5
+    assert max(overlaps) == 1
+    assert not lock_path.exists()
+
+
+def test_lock_release_keeps_a_lock_owned_by_someone_else(tmp_path):
+    lock_path = tmp_path / "admin.lock"
+
+    with plugin.file_lock(lock_path, timeout=60):
+        # Another worker took over the lock while we were holding it
+        lock_path.write_text("other-worker")
+
+    assert plugin.read_lock_owner(lock_path) == "other-worker"
+
+
+def test_held_lock_is_kept_fresh(tmp_path):
+    lock_path = tmp_path / "admin.lock"
+
+    with plugin.file_lock(lock_path, timeout=0.3):
+        time.sleep(0.5)
+        assert time.time() - os.path.getmtime(lock_path) < 0.3
+        owner = plugin.read_lock_owner(lock_path)
+
+    assert owner.startswith(f"{os.getpid()}-")
+
+
+def test_invalidate_keeps_state_refreshed_by_another_worker(tmp_path):
+    state_path = tmp_path / "admin.json"
+    write_storage_state(state_path, [])
+    loaded_mtime = os.path.getmtime(state_path) - 10
+
+    assert not plugin.invalidate_storage_state(state_path, loaded_mtime)
+    assert state_path.exists()
+
+    assert plugin.invalidate_storage_state(state_path, os.path.getmtime(state_path))
+    assert not state_path.exists()
+
+
+class FakeContext:
+    """Browser context stand-in recording the login storage state"""
+
+    def new_page(self):
+        return "page"
+
+    def storage_state(self, path):
+        Path(path).write_text(json.dumps({'cookies': [{'name': 'token', 'expires': -1}], 'origins': []}))
+
+    def close(self):
+        pass
+
+
+def test_storage_state_is_cached_until_invalidated(tmp_path):
+    browser = SimpleNamespace(new_context=FakeContext)
+    logins = []
+    state_path = plugin.get_storage_state_path(tmp_path, "admin user")
+
+    for _ in range(3):
+        state, state_mtime = plugin.get_storage_state(browser, "admin user", state_path, lambda page, role: logins.append(role), 60)
+
+    assert logins == ["admin user"]
+    assert state['cookies'][0]['name'] == 'token'
+
+    plugin.invalidate_storage_state(state_path, state_mtime)
+    plugin.get_storage_state(browser, "admin user", state_path, lambda page, role: logins.append(role), 60)
+
+    assert logins == ["admin user", "admin user"]
+
+
+class FakeConfig:
+    """Config stand-in returning the plugin's command line options"""
+
+    def __init__(self, **options):
+        self.options = {
+            'xray_tracing': "retain-on-failure",
+            'xray_video': "off",
+            'xray_evidence_max_bytes': plugin.DEFAULT_EVIDENCE_MAX_BYTES,
+            **options
+        }
+
+    def getoption(self, name):
+        return self.options[name]
+
+
+class FakeItem:
+    """Test item stand-in with a jira marker and an optional xray_evidence marker"""
+
+    def __init__(self, name="test_checkout", evidence=None, config=None):
+        self.name = name
+        self.nodeid = f"tests/test_example.py::{name}"
+        self.config = config or FakeConfig()
+        self.evidence = evidence
+
+    def iter_markers(self, name):
+        return [SimpleNamespace(args=('SCRUM-9',), kwargs={})] if name == "jira" else []
+
+    def get_closest_marker(self, name):
+        if name == "xray_evidence" and self.evidence is not None:
+            return SimpleNamespace(args=(), kwargs=self.evidence)
+        return None
+
+
+def test_evidence_settings_default_to_command_line_options():
+    settings = plugin.get_evidence_settings(FakeItem(config=FakeConfig(xray_video="on")))
+
+    assert settings == {
+        'tracing': "retain-on-failure",
+        'video': "on",
+        'screenshots': False,
+        'max_bytes': plugin.DEFAULT_EVIDENCE_MAX_BYTES
+    }
+
+
+def test_evidence_marker_overrides_command_line_options():
+    item = FakeItem(evidence={'tracing': "off", 'video': "retain-on-failure", 'screenshots': True, 'max_bytes': 100})
+
+    settings = plugin.get_evidence_settings(item)
+
+    assert settings == {'tracing': "off", 'video': "retain-on-failure", 'screenshots': True, 'max_bytes': 100}
+
+
+@pytest.mark.parametrize("evidence,message", [
+    ({'trace': "on"}, "Unknown xray_evidence option 'trace'"),
+    ({'video': "always"}, "must be one of off, on, retain-on-failure"),
+])
+def test_invalid_evidence_marker_is_rejected(evidence, message):
+    with pytest.raises(ValueError, match=message):
+        plugin.get_evidence_settings(FakeItem(evidence=evidence))
+
+
+def write_artifact(path, size):
+    """Write an incompressible artifact of the given size"""
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def test_evidence_artifacts_are_capped_per_item(tmp_path, monkeypatch):
+    monkeypatch.setattr(plugin, 'ARTIFACTS_DIR', str(tmp_path / "artifacts"))
+    os.makedirs(plugin.ARTIFACTS_DIR)
+    item = FakeItem(name="test_checkout[1]")
+    item._xray_result = make_result('SCRUM-9', 'FAILED')
+    recording_dir = tmp_path / "playwright"
+    recording_dir.mkdir()
+    artifacts = [
+        write_artifact(recording_dir / "trace.zip", 6000),
+        write_artifact(recording_dir / "video.webm", 6000),
+        str(recording_dir / "missing.webm")
+    ]
+
+    plugin.store_evidence_artifacts(item, artifacts, max_bytes=10000)
+
+    # Both artifacts are retained on disk, only the trace fits the cap
+    retained = sorted(os.listdir(plugin.ARTIFACTS_DIR))
+    assert len(retained) == 2
+    assert [os.path.basename(path) for path in item._xray_result['evidence_paths']] == [
+        name for name in retained if name.endswith("_trace.zip")
+    ]
+    assert item._xray_result['evidence_max_bytes'] == 10000
+
+
+def test_evidence_cap_applies_across_iterations(tmp_path):
+    results = []
+    for n, max_bytes in enumerate([20000, 13000, 20000]):
+        result = make_result('SCRUM-9', 'FAILED', parameters={'n': str(n)})
+        result['evidence_paths'] = [write_artifact(tmp_path / f"trace_{n}.zip", 6000)]
+        result['evidence_max_bytes'] = max_bytes
+        results.append(result)
+
+    test = plugin.format_xray_json(results)['tests'][0]
+
+    # The smallest cap of the iterations bounds the whole Xray test
+    assert [evidence['filename'] for evidence in test['evidences']] == ["trace_0.zip", "trace_1.zip"]
+    assert all(evidence['contentType'] == "application/zip" for evidence in test['evidences'])
+
+
+MB = 1024 * 1024
+
+
+def make_sample(cpu_seconds, rss_mb, processes=3):
+    """Process tree sample as returned by sample_process_tree"""
+    return {'cpu_seconds': cpu_seconds, 'rss_bytes': int(rss_mb * MB), 'processes': processes}
+
+
+def test_resource_usage_flags_exceeded_thresholds():
+    config = FakeConfig(xray_max_rss_mb=300, xray_max_cpu_seconds=2)
+    samples = [make_sample(1.0, 200), make_sample(2.0, 450, processes=5), make_sample(4.5, 250)]
+
+    usage = plugin.summarize_resource_usage(samples, None, None, config)
+
+    assert usage['cpu_seconds'] == 3.5
+    assert usage['peak_rss_mb'] == 450
+    assert usage['rss_delta_mb'] == 50
+    assert usage['peak_processes'] == 5
+    assert usage['samples'] == 3
+    assert usage['exceeded'] == ["peak RSS 450.0 MB > 300 MB", "CPU 3.5s > 2s"]
+
+
+def test_resource_usage_without_thresholds_is_not_flagged():
+    config = FakeConfig(xray_max_rss_mb=None, xray_max_cpu_seconds=None)
+
+    usage = plugin.summarize_resource_usage([make_sample(0, 2000), make_sample(60, 4000)], None, None, config)
+
+    assert usage['exceeded'] == []
+
+
+def test_resource_usage_never_reports_negative_cpu():
+    config = FakeConfig(xray_max_rss_mb=None, xray_max_cpu_seconds=None)
+
+    # A renderer exited during the test and took its CPU time with it
+    usage = plugin.summarize_resource_usage([make_sample(5.0, 300), make_sample(2.0, 200)], None, None, config)
+
+    assert usage['cpu_seconds'] == 0.0
+    assert usage['rss_delta_mb'] == -100
+
+
+def test_resource_usage_includes_page_metrics_delta():
+    config = FakeConfig(xray_max_rss_mb=None, xray_max_cpu_seconds=None)
+    start = {'JSHeapUsedSize': 2 * MB, 'Nodes': 100}
+    end = {'JSHeapUsedSize': 5 * MB, 'Nodes': 160, 'Documents': 2}
+
+    usage = plugin.summarize_resource_usage([make_sample(0, 100)], start, end, config)
+
+    assert usage['page_metrics'] == end
+    assert usage['page_metrics_delta'] == {'JSHeapUsedSize': 3 * MB, 'Nodes': 60}
+    assert "JS heap 5.0 MB, 160 DOM nodes" in plugin.format_resource_summary(usage)
+
+
+def test_page_metrics_skip_pages_without_browser():
+    # Persistent contexts have no browser
+    page = SimpleNamespace(is_closed=lambda: False, context=SimpleNamespace(browser=None))
+
+    assert plugin.get_page_metrics(page) is None
+
+
+def test_resource_summary_reports_exceeded_thresholds():
+    usage = {
+        'cpu_seconds': 3.5, 'peak_rss_mb': 450.0, 'rss_delta_mb': 50.0, 'peak_processes': 5,
+        'exceeded': ["peak RSS 450.0 MB > 300 MB"]
+    }
+
+    summary = plugin.format_resource_summary(usage)
+
+    assert summary == (
+        "Resources: CPU 3.5s, peak RSS 450.0 MB (+50.0 MB), 5 processes"
+        " - THRESHOLD EXCEEDED: peak RSS 450.0 MB > 300 MB"
+    )
+
+
+def make_usage(test, peak_rss_mb, exceeded=()):
+    """Resource usage as recorded by the pytest_runtest_call wrapper"""
+    return {
+        'test': test, 'cpu_seconds': 1.0, 'peak_rss_mb': peak_rss_mb, 'rss_delta_mb': 0.0,
+        'peak_processes': 3, 'samples': 2, 'exceeded': list(exceeded)
+    }
+
+
+def test_resource_report_lists_heaviest_tests_first(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("logs")
+    results = [make_result('SCRUM-1', 'PASSED'), make_result('SCRUM-2', 'FAILED'), make_result('SCRUM-3', 'PASSED')]
+    results[0]['resource_usage'] = make_usage("test_light", 100.0)
+    results[1]['resource_usage'] = make_usage("test_leaky", 900.0, ["peak RSS 900.0 MB > 500 MB"])
+
+    filename = plugin.write_resource_report(results)
+
+    with open(filename) as f:
+        report = json.load(f)
+    assert report['tests'] == 2
+    assert report['peak_rss_mb'] == 900.0
+    assert report['total_cpu_seconds'] == 2.0
+    assert report['flagged'] == ["test_leaky"]
+    assert [entry['jira_id'] for entry in report['results']] == ['SCRUM-2', 'SCRUM-1']
+
+
+def test_resource_report_is_skipped_without_samples():
+    assert plugin.write_resource_report([make_result('SCRUM-1', 'PASSED')]) is None
+
+
+def test_resource_summary_goes_to_iteration_log_or_comment():
+    parametrized = [make_result('SCRUM-17', 'PASSED', parameters={'n': '1'}), make_result('SCRUM-17', 'PASSED', parameters={'n': '2'})]
+    parametrized[0]['resource_usage'] = make_usage("test_titles[1]", 100.0)
+    single = make_result('SCRUM-8', 'PASSED')
+    single['resource_usage'] = make_usage("test_title", 200.0)
+
+    tests = {test['testKey']: test for test in plugin.format_xray_json(parametrized + [single])['tests']}
+
+    iterations = tests['SCRUM-17']['iterations']
+    assert iterations[0]['log'].endswith("peak RSS 100.0 MB (+0.0 MB), 3 processes")
+    assert "Resources" not in iterations[1]['log']
+    assert "Resources" not in tests['SCRUM-17']['comment']
+    assert tests['SCRUM-8']['comment'] == (
+        "Test execution completed with status: PASSED\n"
+        "Resources: CPU 1.0s, peak RSS 200.0 MB (+0.0 MB), 3 processes"
+    )